@@ -1,19 +1,91 @@
+import asyncio
+import atexit
+import hashlib
+import logging
 import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from itertools import compress
 from pathlib import Path
 from typing import Literal
 
+import httpx
+import numpy as np
 from mcp.server.fastmcp import FastMCP
-from PIL import ImageDraw, ImageFont
-from staticmap import CircleMarker, Line, StaticMap
+from PIL import Image, ImageDraw, ImageFont
+from staticmap import StaticMap
+
+try:
+    import numba
+except ImportError:  # optional accelerator for long routes, see the "numba" extra
+    numba = None
 
 mcp = FastMCP("staticmap")
 
+_FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+# Upper bound on simultaneous tile downloads (and pooled HTTP connections)
+_TILE_WORKERS = 16
+_TILE_RETRIES = 3
+# Per-request timeout (seconds) unless the map sets its own request_timeout
+_TILE_TIMEOUT = 10.0
+
+# httpx logs every request at INFO, which FastMCP's logging setup would forward
+# to the client's server log for each tile
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Persistent tile cache, trimmed least-recently-used first once it outgrows the cap
+_CACHE_DIR = Path(
+    os.environ.get("STATICMAP_MCP_CACHE_DIR", Path.home() / ".cache" / "staticmap_mcp")
+)
+_TILE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Size of the tile cache as last scanned plus what this process has written since,
+# so the directory is only walked again when that goes over the cap or gets old
+_tile_cache_bytes: int | None = None
+_tile_cache_scanned_at = 0.0
+_tile_cache_lock = threading.Lock()
+_TILE_CACHE_RESCAN_SECONDS = 600
+# Temp files older than this were left behind by an interrupted write
+_STALE_TMP_SECONDS = 3600
+
+# Below this many points NumPy beats the call overhead of the Numba kernel
+_NUMBA_MIN_POINTS = 1024
+
+# Marker dots and the route are drawn onto the rendered map rather than by staticmap,
+# on a layer _SUPERSAMPLE times larger that is downsampled for anti-aliasing
+_MARKER_RADIUS = 4
+_MARKER_COLOR = "red"
+_SUPERSAMPLE = 2
+
+# zlib level for the output PNG: map imagery barely compresses further at
+# higher levels, so favour encode speed
+_PNG_COMPRESS_LEVEL = 1
+
+# Finished PNGs of recent renders, keyed by a hash of the render inputs. The copies
+# live in a per-process temporary directory, since this index does not outlive the server
+_RENDER_CACHE: OrderedDict[str, Path] = OrderedDict()
+_RENDER_CACHE_SIZE = 32
+
 BASEMAPS = {
     "osm": "https://a.tile.openstreetmap.org/{z}/{x}/{y}.png",
     "topo": "https://tile.opentopomap.org/{z}/{x}/{y}.png",
     "cycle": "https://a.tile-cyclosm.openstreetmap.fr/cyclosm/{z}/{x}/{y}.png",
     "humanitarian": "https://a.tile.openstreetmap.fr/hot/{z}/{x}/{y}.png",
 }
+_DEFAULT_BASEMAP = "osm"
+
+# Minimum distance in pixels between the route/markers and the image border
+_MAP_PADDING = 20
+
+# quality="draft" renders the map at 1/_DRAFT_SCALE of the requested size
+_DRAFT_SCALE = 2
 
 
 @mcp.tool()
@@ -26,6 +98,7 @@ async def render_route_map(
     line_color: str = "black",
     line_width: int = 3,
     basemap: Literal["osm", "topo", "cycle", "humanitarian"] = "osm",
+    quality: Literal["draft", "normal"] = "normal",
 ) -> str:
     """Render a route on an OpenStreetMap tile map and save as PNG.
 
@@ -38,50 +111,103 @@ async def render_route_map(
         line_color: Route line colour (default "black")
         line_width: Route line width in pixels (default 3)
         basemap: Map tile style — "osm" (default), "topo" (terrain/hiking), "cycle" (cycling), "humanitarian"
+        quality: "normal" (default) or "draft" — renders the map at half size and upscales it, fetching about a quarter of the tiles; markers and labels stay sharp
     """
-    if not coordinates or len(coordinates) < 2:
+    try:
+        coords = np.asarray(coordinates, dtype=np.float64)
+    except (TypeError, ValueError):
+        coords = None
+    if coords is None or coords.ndim != 2 or coords.shape[0] < 2 or coords.shape[1] < 2:
         return "Error: coordinates must contain at least 2 [lon, lat] pairs."
+    # Extra columns (e.g. elevation) are ignored
+    coords = np.ascontiguousarray(coords[:, :2])
+    if not np.isfinite(coords).all():
+        return "Error: coordinates must be finite numbers."
 
-    tile_url = BASEMAPS.get(basemap, BASEMAPS["osm"])
-    m = StaticMap(width, height, padding_x=20, padding_y=20, url_template=tile_url)
+    # Split markers into parallel arrays once; a missing lon/lat comes through as NaN
+    markers = markers or []
+    try:
+        marker_lons = np.array([mk.get("lon") for mk in markers], dtype=np.float64)
+        marker_lats = np.array([mk.get("lat") for mk in markers], dtype=np.float64)
+    except (TypeError, ValueError):
+        return "Error: marker lon and lat must be numbers."
+    if np.isinf(marker_lons).any() or np.isinf(marker_lats).any():
+        return "Error: marker lon and lat must be numbers."
+    placed = ~(np.isnan(marker_lons) | np.isnan(marker_lats))
+    marker_lons = marker_lons[placed]
+    marker_lats = marker_lats[placed]
+    marker_labels = list(compress([mk.get("label") for mk in markers], placed.tolist()))
 
-    # Draw route line
-    line_coords = [(c[0], c[1]) for c in coordinates]
-    m.add_line(Line(line_coords, line_color, line_width))
+    tile_url = BASEMAPS.get(basemap)
+    if tile_url is None:
+        basemap, tile_url = _DEFAULT_BASEMAP, BASEMAPS[_DEFAULT_BASEMAP]
 
-    # Add markers
-    if markers:
-        for marker in markers:
-            lon = marker.get("lon")
-            lat = marker.get("lat")
-            if lon is not None and lat is not None:
-                m.add_marker(CircleMarker((lon, lat), "red", 8))
+    out = Path(output_path).resolve()
+    key = _render_key(coords, markers, width, height, line_color, line_width, basemap, quality)
+    cached = _RENDER_CACHE.get(key)
+    if cached is not None and cached.exists():
+        # Identical request (e.g. a client retry): reuse the previous PNG
+        _RENDER_CACHE.move_to_end(key)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(cached, out)
+        return str(out)
 
-    # Render map
-    image = m.render()
+    # Draft renders the map at reduced size and upscales it before markers and labels
+    scale = _DRAFT_SCALE if quality == "draft" else 1
+    m = _TileMap(
+        max(1, width // scale),
+        max(1, height // scale),
+        padding_x=_MAP_PADDING // scale,
+        padding_y=_MAP_PADDING // scale,
+        url_template=tile_url,
+        basemap=basemap,
+    )
 
-    # Draw text labels on markers
-    if markers:
-        draw = ImageDraw.Draw(image)
-        try:
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 12)
-        except (OSError, IOError):
-            font = ImageFont.load_default()
-
-        for marker in markers:
-            lon = marker.get("lon")
-            lat = marker.get("lat")
-            label = marker.get("label", "")
-            if lon is None or lat is None or not label:
-                continue
+    # The route and markers are drawn after render; staticmap only reserves room for them
+    # in the extent, with the route represented by the corners of its bounding box
+    for lon, lat in (coords.min(axis=0).tolist(), coords.max(axis=0).tolist()):
+        m.add_marker(_Footprint((lon, lat), 0))
+    for lon, lat in zip(marker_lons.tolist(), marker_lats.tolist()):
+        m.add_marker(_Footprint((lon, lat), 2 * _MARKER_RADIUS))
 
-            # Convert geo coordinates to pixel coordinates
-            px, py = _geo_to_pixel(m, lon, lat)
+    # Render map (tile downloads and compositing block, so keep them off the event loop)
+    image = await asyncio.to_thread(m.render)
+    if image.size != (width, height):
+        image = await asyncio.to_thread(image.resize, (width, height), Image.LANCZOS)
 
-            # Draw label with background for readability
-            bbox = draw.textbbox((0, 0), label, font=font)
-            tw = bbox[2] - bbox[0]
-            th = bbox[3] - bbox[1]
+    # Project the route and markers in one vectorized pass each, at overlay resolution
+    project = _make_projector(m, (width * _SUPERSAMPLE, height * _SUPERSAMPLE))
+    route_x, route_y = project(coords[:, 0], coords[:, 1])
+    marker_x, marker_y = project(marker_lons, marker_lats)
+    await asyncio.to_thread(
+        _draw_overlay, image, route_x, route_y, marker_x, marker_y, line_color, line_width
+    )
+    labeled = [
+        (label, px, py)
+        for label, px, py in zip(
+            marker_labels,
+            (marker_x // _SUPERSAMPLE).tolist(),
+            (marker_y // _SUPERSAMPLE).tolist(),
+        )
+        if label
+    ]
+
+    # Draw text labels on markers; circle-only markers need no font
+    if labeled:
+        # staticmap renders RGB; label colours are opaque, so draw in place without an alpha layer
+        draw = ImageDraw.Draw(image, "RGB")
+        font = _get_font()
+        # Repeated labels ("Start", "End", ...) are only laid out once
+        label_sizes: dict[str, tuple[int, int]] = {}
+        boxes = []
+        texts = []
+
+        for label, px, py in labeled:
+            size = label_sizes.get(label)
+            if size is None:
+                bbox = draw.textbbox((0, 0), label, font=font)
+                size = label_sizes[label] = (bbox[2] - bbox[0], bbox[3] - bbox[1])
+            tw, th = size
             label_x = px + 10
             label_y = py - th // 2
 
@@ -89,40 +215,407 @@ async def render_route_map(
             label_x = min(label_x, width - tw - 4)
             label_y = max(4, min(label_y, height - th - 4))
 
-            draw.rectangle(
-                [label_x - 2, label_y - 2, label_x + tw + 2, label_y + th + 2],
-                fill="white",
-                outline="gray",
-            )
-            draw.text((label_x, label_y), label, fill="black", font=font)
+            boxes.append([label_x - 2, label_y - 2, label_x + tw + 2, label_y + th + 2])
+            texts.append(((label_x, label_y), label))
+
+        # Draw all label backgrounds first, then all text, so no background
+        # can cover a neighbouring label's text
+        rectangle = draw.rectangle
+        for box in boxes:
+            rectangle(box, fill="white", outline="gray")
+        text = draw.text
+        for xy, label in texts:
+            text(xy, label, fill="black", font=font)
 
     # Save
-    out = Path(output_path).resolve()
     out.parent.mkdir(parents=True, exist_ok=True)
-    image.save(str(out), "PNG")
+    await asyncio.to_thread(image.save, str(out), "PNG", compress_level=_PNG_COMPRESS_LEVEL)
+    _remember_render(key, out)
 
     return str(out)
 
 
-def _geo_to_pixel(m: StaticMap, lon: float, lat: float) -> tuple[int, int]:
-    """Convert geographic coordinates to pixel position on the rendered image.
+def _draw_overlay(
+    image: Image.Image,
+    route_x: np.ndarray,
+    route_y: np.ndarray,
+    marker_x: np.ndarray,
+    marker_y: np.ndarray,
+    line_color: str,
+    line_width: int,
+) -> None:
+    """Draw the route and marker dots onto the map, anti-aliased.
+
+    Coordinates are in overlay pixels (_SUPERSAMPLE times the image size). Like
+    staticmap, everything is drawn on an oversized layer that is downsampled
+    before pasting, since Pillow does not anti-alias lines or ellipses.
+    """
+    k = _SUPERSAMPLE
+    layer = Image.new("RGBA", (image.width * k, image.height * k), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+
+    # Consecutive points landing on the same pixel add nothing but segments to rasterise
+    keep = np.ones(route_x.shape, dtype=bool)
+    keep[1:] = (np.diff(route_x) != 0) | (np.diff(route_y) != 0)
+    points = list(zip(route_x[keep].tolist(), route_y[keep].tolist()))
+    width = line_width * k
+    draw.line(points, fill=line_color, width=width, joint="curve")
+    # Round caps at both ends
+    r = width / 2
+    for x, y in (points[0], points[-1]):
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=line_color)
+
+    r = _MARKER_RADIUS * k
+    for x, y in zip(marker_x.tolist(), marker_y.tolist()):
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=_MARKER_COLOR)
+
+    layer = layer.resize(image.size, Image.LANCZOS)
+    image.paste(layer, (0, 0), layer)
+
+
+class _Footprint:
+    """Feature stand-in that staticmap counts towards the map extent but never draws.
+
+    staticmap only draws CircleMarker and IconMarker instances; anything else
+    in StaticMap.markers just needs a lon/lat `coord` and a pixel `extent_px`.
+    """
+
+    def __init__(self, coord: tuple[float, float], extent: int):
+        self.coord = coord
+        self.extent_px = (extent,) * 4
+
+
+def _render_key(coords: np.ndarray, *options) -> str:
+    """Digest of the render inputs, used to recognise repeated requests."""
+    digest = hashlib.blake2b(coords.tobytes(), digest_size=16)
+    digest.update(repr(options).encode())
+    return digest.hexdigest()
+
+
+def _remember_render(key: str, out: Path) -> None:
+    """Keep a copy of a finished PNG, dropping the least recently used beyond the cap."""
+    try:
+        path = _get_render_dir() / f"{key}.png"
+        shutil.copyfile(out, path)
+    except OSError:
+        return
+    _RENDER_CACHE[key] = path
+    _RENDER_CACHE.move_to_end(key)
+    while len(_RENDER_CACHE) > _RENDER_CACHE_SIZE:
+        _old_key, old_path = _RENDER_CACHE.popitem(last=False)
+        old_path.unlink(missing_ok=True)
+
+
+@lru_cache(maxsize=1)
+def _get_render_dir() -> Path:
+    """Create this process's directory for render copies, removed again at exit."""
+    path = Path(tempfile.mkdtemp(prefix="staticmap_mcp-renders-"))
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+@lru_cache(maxsize=1)
+def _get_font() -> ImageFont.ImageFont | ImageFont.FreeTypeFont:
+    """Load the label font once; falls back to Pillow's built-in font.
+
+    Labels use Pillow's basic layout engine, which is much cheaper than Raqm
+    for plain labels. Set STATICMAP_MCP_TEXT_LAYOUT=raqm for right-to-left or
+    complex-script labels.
+    """
+    layout = getattr(ImageFont, "Layout", None)  # Pillow < 9.1 has no Layout enum
+    kwargs = {}
+    if layout is not None and os.environ.get("STATICMAP_MCP_TEXT_LAYOUT", "").lower() != "raqm":
+        kwargs["layout_engine"] = layout.BASIC
+    try:
+        return ImageFont.truetype(_FONT_PATH, 12, **kwargs)
+    except (OSError, IOError):
+        return ImageFont.load_default()
+
+
+_http_client: httpx.Client | None = None
+_http_client_lock = threading.Lock()
+
+
+def _get_http_client() -> httpx.Client:
+    """Shared HTTP/2 client so tile requests multiplex over pooled connections across renders."""
+    global _http_client
+    # Renders run in worker threads, so creation must not race into several clients
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                http2=True,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=_TILE_WORKERS),
+                timeout=_TILE_TIMEOUT,
+            )
+        return _http_client
+
+
+class _TileMap(StaticMap):
+    """StaticMap that fetches all tiles of the viewport concurrently.
+
+    staticmap downloads through a fresh `requests` connection per tile with
+    four worker threads; here every tile is requested at once through the
+    shared HTTP/2 client and decoded off the compositing thread. Tiles are
+    served from the on-disk cache when present and stored there otherwise.
+    """
+
+    def __init__(self, *args, basemap: str = "osm", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.basemap = basemap
+        self._cache_written = False
+
+    def _load_tile(self, client: httpx.Client, cache_key: str, url: str) -> Image.Image | None:
+        """Read one tile from the cache or download it; None if the request failed."""
+        content = _read_cached_tile(cache_key)
+        if content is not None:
+            tile_image = _decode_tile(content)
+            if tile_image is not None:
+                return tile_image
+            # Unreadable cache entry: drop it and download the tile again
+            _drop_cached_tile(cache_key)
+
+        # staticmap's request_timeout defaults to None, which to httpx means no
+        # timeout at all; leave the client's default in place unless one is set
+        kwargs = {} if self.request_timeout is None else {"timeout": self.request_timeout}
+        try:
+            res = client.get(url, headers=self.headers, **kwargs)
+        except httpx.HTTPError:
+            return None
+        if res.status_code != 200:
+            return None
+        content = res.content
+        # A 200 can still carry an HTML error page or a truncated body; only
+        # tiles that decode are cached, anything else is retried
+        tile_image = _decode_tile(content)
+        if tile_image is None:
+            return None
+        _write_cached_tile(cache_key, content)
+        self._cache_written = True
+        return tile_image
+
+    def _draw_base_layer(self, image):
+        x_min = math.floor(self.x_center - (0.5 * self.width / self.tile_size))
+        y_min = math.floor(self.y_center - (0.5 * self.height / self.tile_size))
+        x_max = math.ceil(self.x_center + (0.5 * self.width / self.tile_size))
+        y_max = math.ceil(self.y_center + (0.5 * self.height / self.tile_size))
+
+        max_tile = 2**self.zoom
+        tiles = []
+        for x in range(x_min, x_max):
+            for y in range(y_min, y_max):
+                # x and y may have crossed the date line
+                tile_x = (x + max_tile) % max_tile
+                tile_y = (y + max_tile) % max_tile
+                if self.reverse_y:
+                    tile_y = max_tile - tile_y - 1
+                cache_key = f"{self.basemap}/{self.zoom}/{tile_x}/{tile_y}.png"
+                url = self.url_template.format(z=self.zoom, x=tile_x, y=tile_y)
+                tiles.append((x, y, cache_key, url))
+
+        client = _get_http_client()
+        with ThreadPoolExecutor(max(1, min(len(tiles), _TILE_WORKERS))) as pool:
+            for _ in range(_TILE_RETRIES):
+                if not tiles:
+                    break
+                failed = []
+                loaded = pool.map(lambda t: self._load_tile(client, t[2], t[3]), tiles)
+                for tile, tile_image in zip(tiles, loaded):
+                    if tile_image is None:
+                        failed.append(tile)
+                        continue
+                    x, y = tile[:2]
+                    box = [
+                        self._x_to_px(x),
+                        self._y_to_px(y),
+                        self._x_to_px(x + 1),
+                        self._y_to_px(y + 1),
+                    ]
+                    image.paste(tile_image, box, tile_image)
+                tiles = failed
+
+        if self._cache_written:
+            _trim_tile_cache()
+        if tiles:
+            raise RuntimeError(f"could not download {len(tiles)} tiles: {[t[3] for t in tiles]}")
+
+
+def _read_cached_tile(cache_key: str) -> bytes | None:
+    """Return cached tile bytes, marking the entry as recently used."""
+    path = _CACHE_DIR / "tiles" / cache_key
+    try:
+        content = path.read_bytes()
+    except OSError:
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass  # read-only or shared cache: the tile is still usable
+    return content
+
+
+def _drop_cached_tile(cache_key: str) -> None:
+    try:
+        (_CACHE_DIR / "tiles" / cache_key).unlink(missing_ok=True)
+    except OSError:
+        pass
+
+
+def _decode_tile(content: bytes) -> Image.Image | None:
+    """Decode tile bytes to RGBA; None if they are not a readable image."""
+    try:
+        return Image.open(BytesIO(content)).convert("RGBA")
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def _write_cached_tile(cache_key: str, content: bytes) -> None:
+    """Store tile bytes atomically; caching is best-effort and never fails a render."""
+    global _tile_cache_bytes
+    path = _CACHE_DIR / "tiles" / cache_key
+    tmp = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except OSError:
+        if tmp is not None:
+            _unlink_quietly(Path(tmp))
+        return
+    with _tile_cache_lock:
+        if _tile_cache_bytes is not None:
+            _tile_cache_bytes += len(content)
+
+
+def _unlink_quietly(path: Path) -> bool:
+    try:
+        path.unlink(missing_ok=True)
+    except OSError:
+        return False
+    return True
+
+
+def _trim_tile_cache() -> None:
+    """Keep the tile cache within _TILE_CACHE_MAX_BYTES.
+
+    Cheap after the first call in a process: the directory is only scanned
+    again once the running total passes the cap or the last scan is stale.
+    """
+    global _tile_cache_bytes, _tile_cache_scanned_at
+    with _tile_cache_lock:
+        now = time.monotonic()
+        if (
+            _tile_cache_bytes is not None
+            and _tile_cache_bytes <= _TILE_CACHE_MAX_BYTES
+            and now - _tile_cache_scanned_at < _TILE_CACHE_RESCAN_SECONDS
+        ):
+            return
+        _tile_cache_bytes = _scan_tile_cache()
+        _tile_cache_scanned_at = now
+
+
+def _scan_tile_cache() -> int:
+    """Delete stale temp files and least-recently-used tiles; return the size left."""
+    entries = []
+    total = 0
+    stale_before = time.time() - _STALE_TMP_SECONDS
+    for path in (_CACHE_DIR / "tiles").rglob("*"):
+        if path.suffix not in (".png", ".tmp"):
+            continue
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        if path.suffix == ".tmp":
+            # Leftover from an interrupted write; recent ones may still be in flight
+            if st.st_mtime < stale_before and _unlink_quietly(path):
+                continue
+        else:
+            entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+    if total <= _TILE_CACHE_MAX_BYTES:
+        return total
+    for _mtime, size, path in sorted(entries):
+        if _unlink_quietly(path):
+            total -= size
+        if total <= _TILE_CACHE_MAX_BYTES:
+            break
+    return total
+
+
+def _make_projector(m: StaticMap, size: tuple[int, int] | None = None):
+    """Return a function converting lon/lat arrays to pixel positions on the rendered image.
 
     After render(), staticmap sets m.x_center and m.y_center (tile-space
-    coordinates for the center of the image) and m.zoom.
+    coordinates for the center of the image) and m.zoom; they are read once
+    here rather than on every call. Pass `size` when the rendered image was
+    resized afterwards.
     """
-    zoom = m.zoom
-    n = 2**zoom
-    tile_size = m.tile_size
-
-    # Convert lon/lat to tile-space coordinates (same formula staticmap uses)
-    x_tile = (lon + 180.0) / 360.0 * n
-    lat_rad = math.radians(lat)
-    y_tile = (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n
-
-    # m.x_center / m.y_center are the tile-space coords of the image center
-    px = int((x_tile - m.x_center) * tile_size + m.width / 2)
-    py = int((y_tile - m.y_center) * tile_size + m.height / 2)
-    return (px, py)
+    n = float(2**m.zoom)
+    x_center = float(m.x_center)
+    y_center = float(m.y_center)
+    out_w, out_h = size or (m.width, m.height)
+    half_w = out_w / 2
+    half_h = out_h / 2
+    # Pixels per tile along each axis of the output image
+    scale_x = m.tile_size * out_w / m.width
+    scale_y = m.tile_size * out_h / m.height
+
+    def project(lons, lats) -> tuple[np.ndarray, np.ndarray]:
+        lons = np.ascontiguousarray(lons, dtype=np.float64)
+        lats = np.ascontiguousarray(lats, dtype=np.float64)
+
+        if numba is not None and lons.size >= _NUMBA_MIN_POINTS:
+            px = np.empty(lons.shape, dtype=np.int32)
+            py = np.empty(lons.shape, dtype=np.int32)
+            _project_points(
+                lons, lats, n, x_center, y_center, scale_x, scale_y, half_w, half_h, px, py
+            )
+            return px, py
+
+        # Convert lon/lat to tile-space coordinates (same formula staticmap uses)
+        lats_rad = np.radians(lats)
+        x_tile = (lons + 180.0) / 360.0 * n
+        # log(tan(lat) + sec(lat)) == asinh(tan(lat)), one transcendental instead of three
+        y_tile = (1.0 - np.arcsinh(np.tan(lats_rad)) / np.pi) / 2.0 * n
+
+        # x_center / y_center are the tile-space coords of the image center
+        px = ((x_tile - x_center) * scale_x + half_w).astype(np.int32)
+        py = ((y_tile - y_center) * scale_y + half_h).astype(np.int32)
+        return px, py
+
+    return project
+
+
+if numba is not None:
+
+    @numba.njit(cache=True, fastmath=True, parallel=True)
+    def _project_points(
+        lons, lats, n, x_center, y_center, scale_x, scale_y, half_w, half_h, out_x, out_y
+    ):
+        """Fused, multi-threaded version of the projection in _make_projector."""
+        for i in numba.prange(lons.shape[0]):
+            x_tile = (lons[i] + 180.0) / 360.0 * n
+            y_tile = (1.0 - math.asinh(math.tan(math.radians(lats[i]))) / math.pi) / 2.0 * n
+            out_x[i] = int((x_tile - x_center) * scale_x + half_w)
+            out_y[i] = int((y_tile - y_center) * scale_y + half_h)
+
+    # Compile at import so the first long route doesn't pay for it
+    _project_points(
+        np.zeros(1),
+        np.zeros(1),
+        1.0,
+        0.5,
+        0.5,
+        256.0,
+        256.0,
+        0.5,
+        0.5,
+        np.zeros(1, dtype=np.int32),
+        np.zeros(1, dtype=np.int32),
+    )
 
 
 def main():
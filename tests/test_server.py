@@ -1,18 +1,34 @@
+import io
+import logging
 import os
 import tempfile
+from collections import OrderedDict
 from unittest.mock import patch
 
+import httpx
+import numpy as np
 import pytest
 from PIL import Image
+from staticmap import Line, StaticMap
+from staticmap.staticmap import _lat_to_y, _lon_to_x
 
-from staticmap_mcp.server import render_route_map
+from staticmap_mcp import server
+from staticmap_mcp.server import (
+    _get_font,
+    _make_projector,
+    _read_cached_tile,
+    _TileMap,
+    _trim_tile_cache,
+    _write_cached_tile,
+    render_route_map,
+)
 
 
 def _mock_render(self, zoom=None):
     """Return a blank image instead of downloading tiles."""
     self.zoom = zoom or 10
     n = 2**self.zoom
-    # Set center tile coordinates (needed for _geo_to_pixel)
+    # Set center tile coordinates (needed for _make_projector)
     extent = self.determine_extent(self.zoom)
     if extent:
         min_lon, min_lat, max_lon, max_lat = extent
@@ -22,15 +38,21 @@ def _mock_render(self, zoom=None):
 
         self.x_center = (cx + 180.0) / 360.0 * n
         lat_rad = math.radians(cy)
-        self.y_center = (
-            (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n
-        )
+        self.y_center = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
     else:
         self.x_center = n / 2
         self.y_center = n / 2
     return Image.new("RGB", (self.width, self.height), "white")
 
 
+@pytest.fixture(autouse=True)
+def _isolated_cache(tmp_path, monkeypatch):
+    """Keep tile and render caches out of the user's home directory."""
+    monkeypatch.setattr("staticmap_mcp.server._CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr("staticmap_mcp.server._RENDER_CACHE", OrderedDict())
+    monkeypatch.setattr("staticmap_mcp.server._tile_cache_bytes", None)
+
+
 SAMPLE_COORDS = [[-17.1, 28.1], [-17.2, 28.2], [-17.3, 28.15]]
 SAMPLE_MARKERS = [
     {"lon": -17.1, "lat": 28.1, "label": "Start"},
@@ -48,6 +70,8 @@ async def test_basic_route():
         assert os.path.exists(result)
         img = Image.open(result)
         assert img.size == (800, 600)
+        # The route is drawn in black over the blank mock map
+        assert (0, 0, 0) in {color for _count, color in img.getcolors(800 * 600)}
 
 
 @pytest.mark.asyncio
@@ -87,6 +111,30 @@ async def test_single_point():
     assert "Error" in result
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "coordinates",
+    [
+        [[-17.1], [-17.2, 28.2]],
+        [[-17.1, "north"], [-17.2, 28.2]],
+        [[-17.1, float("nan")], [-17.2, 28.2]],
+    ],
+)
+async def test_malformed_coordinates(coordinates):
+    result = await render_route_map(coordinates=coordinates, output_path="/tmp/nope.png")
+    assert "Error" in result
+
+
+@pytest.mark.asyncio
+async def test_coordinates_with_elevation():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out = os.path.join(tmpdir, "route.png")
+        coords = [[lon, lat, 1200.0] for lon, lat in SAMPLE_COORDS]
+        with patch("staticmap_mcp.server.StaticMap.render", _mock_render):
+            result = await render_route_map(coordinates=coords, output_path=out)
+        assert os.path.exists(result)
+
+
 @pytest.mark.asyncio
 async def test_creates_parent_directories():
     with tempfile.TemporaryDirectory() as tmpdir:
@@ -113,8 +161,290 @@ async def test_markers_without_labels():
     with tempfile.TemporaryDirectory() as tmpdir:
         out = os.path.join(tmpdir, "route.png")
         markers = [{"lon": -17.1, "lat": 28.1}]
+        with (
+            patch("staticmap_mcp.server.StaticMap.render", _mock_render),
+            patch("staticmap_mcp.server._get_font") as get_font,
+        ):
+            result = await render_route_map(
+                coordinates=SAMPLE_COORDS, output_path=out, markers=markers
+            )
+        assert os.path.exists(result)
+        get_font.assert_not_called()
+        colors = {color for _count, color in Image.open(result).getcolors()}
+        assert (255, 0, 0) in colors
+
+
+@pytest.mark.asyncio
+async def test_markers_with_missing_or_bad_coordinates():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out = os.path.join(tmpdir, "route.png")
+        markers = [{"lat": 28.1, "label": "No lon"}, {"lon": -17.3, "lat": 28.15, "label": "End"}]
         with patch("staticmap_mcp.server.StaticMap.render", _mock_render):
             result = await render_route_map(
                 coordinates=SAMPLE_COORDS, output_path=out, markers=markers
             )
         assert os.path.exists(result)
+
+    for bad_lon in ("west", float("inf"), float("-inf")):
+        bad = [{"lon": bad_lon, "lat": 28.1, "label": "Start"}]
+        result = await render_route_map(
+            coordinates=SAMPLE_COORDS, output_path="/tmp/nope.png", markers=bad
+        )
+        assert result == "Error: marker lon and lat must be numbers."
+
+
+@pytest.mark.asyncio
+async def test_draft_quality_renders_small_and_upscales():
+    sizes = []
+
+    def recording_render(self, zoom=None):
+        sizes.append((self.width, self.height))
+        return _mock_render(self, zoom)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        out = os.path.join(tmpdir, "route.png")
+        with patch("staticmap_mcp.server.StaticMap.render", recording_render):
+            result = await render_route_map(
+                coordinates=SAMPLE_COORDS,
+                output_path=out,
+                markers=SAMPLE_MARKERS,
+                quality="draft",
+            )
+        assert sizes == [(400, 300)]
+        assert Image.open(result).size == (800, 600)
+
+
+@pytest.mark.asyncio
+async def test_repeated_request_reuses_rendered_png(tmp_path):
+    calls = []
+
+    def counting_render(self, zoom=None):
+        calls.append(self)
+        return _mock_render(self, zoom)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        first = os.path.join(tmpdir, "first.png")
+        second = os.path.join(tmpdir, "second.png")
+        with patch("staticmap_mcp.server.StaticMap.render", counting_render):
+            await render_route_map(coordinates=SAMPLE_COORDS, output_path=first)
+            result = await render_route_map(coordinates=SAMPLE_COORDS, output_path=second)
+            assert len(calls) == 1
+            await render_route_map(coordinates=SAMPLE_COORDS, output_path=second, width=640)
+            assert len(calls) == 2
+        assert result == os.path.realpath(second)
+        assert Image.open(first).size == (800, 600)
+    # Render copies are per-process temporaries, never left in the persistent cache
+    assert not (tmp_path / "cache" / "renders").exists()
+
+
+def test_projector_matches_staticmap():
+    """Vectorized projection agrees with staticmap's own scalar projection."""
+    m = StaticMap(800, 600)
+    m.zoom = 12
+    m.x_center = _lon_to_x(-17.2, m.zoom)
+    m.y_center = _lat_to_y(28.15, m.zoom)
+    lons = [-17.1, -17.2, -17.3]
+    lats = [28.1, 28.15, 28.2]
+    xs, ys = _make_projector(m)(lons, lats)
+    for lon, lat, px, py in zip(lons, lats, xs, ys):
+        assert abs(px - m._x_to_px(_lon_to_x(lon, m.zoom))) <= 1
+        assert abs(py - m._y_to_px(_lat_to_y(lat, m.zoom))) <= 1
+
+
+def test_font_loaded_once():
+    assert _get_font() is _get_font()
+
+
+def test_font_uses_basic_layout(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        "staticmap_mcp.server.ImageFont.truetype", lambda *args, **kwargs: calls.append(kwargs)
+    )
+    _get_font.cache_clear()
+    try:
+        _get_font()
+    finally:
+        _get_font.cache_clear()
+    assert calls == [{"layout_engine": server.ImageFont.Layout.BASIC}]
+
+
+def test_tile_requests_are_not_logged():
+    assert not logging.getLogger("httpx").isEnabledFor(logging.INFO)
+
+
+def _tile_client(requested, first_response=None):
+    """HTTP client serving solid blue tiles, failing each URL's first request."""
+    buf = io.BytesIO()
+    Image.new("RGB", (256, 256), "blue").save(buf, "PNG")
+    tile = buf.getvalue()
+
+    def handler(request):
+        url = str(request.url)
+        requested.append(url)
+        if requested.count(url) == 1:
+            return first_response or httpx.Response(503)
+        return httpx.Response(200, content=tile)
+
+    return httpx.Client(transport=httpx.MockTransport(handler))
+
+
+def test_tile_map_fetches_and_retries_tiles():
+    requested = []
+    m = _TileMap(300, 200, url_template="https://tiles.test/{z}/{x}/{y}.png")
+    m.add_line(Line([(c[0], c[1]) for c in SAMPLE_COORDS], "black", 3))
+    with patch("staticmap_mcp.server._get_http_client", lambda: _tile_client(requested)):
+        image = m.render()
+    assert len(set(requested)) * 2 == len(requested)
+    assert image.getpixel((0, 0)) == (0, 0, 255)
+
+
+def test_tile_map_builds_http_client_once(monkeypatch):
+    requested = []
+    transport = _tile_client(requested)._transport
+    built = []
+
+    class CountingClient(httpx.Client):
+        def __init__(self, **kwargs):
+            built.append(self)
+            super().__init__(transport=transport)
+
+    monkeypatch.setattr("staticmap_mcp.server._http_client", None)
+    monkeypatch.setattr("staticmap_mcp.server.httpx.Client", CountingClient)
+    m = _TileMap(600, 400, url_template="https://tiles.test/{z}/{x}/{y}.png")
+    m.add_line(Line([(c[0], c[1]) for c in SAMPLE_COORDS], "black", 3))
+    m.render()
+    assert len(set(requested)) > 1
+    assert len(built) == 1
+
+
+def test_tile_requests_keep_a_finite_timeout(monkeypatch):
+    timeouts = []
+
+    def handler(request):
+        timeouts.append(request.extensions["timeout"]["read"])
+        return httpx.Response(404)
+
+    class MockClient(httpx.Client):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs, transport=httpx.MockTransport(handler))
+
+    monkeypatch.setattr("staticmap_mcp.server._http_client", None)
+    monkeypatch.setattr("staticmap_mcp.server.httpx.Client", MockClient)
+    m = _TileMap(300, 200, url_template="https://tiles.test/{z}/{x}/{y}.png")
+    m.add_line(Line([(c[0], c[1]) for c in SAMPLE_COORDS], "black", 3))
+    with pytest.raises(RuntimeError):
+        m.render()
+    assert timeouts and all(t == server._TILE_TIMEOUT for t in timeouts)
+
+
+def test_tile_map_serves_repeat_tiles_from_disk_cache():
+    requested = []
+    with patch("staticmap_mcp.server._get_http_client", lambda: _tile_client(requested)):
+        for _ in range(2):
+            m = _TileMap(300, 200, url_template="https://tiles.test/{z}/{x}/{y}.png")
+            m.add_line(Line([(c[0], c[1]) for c in SAMPLE_COORDS], "black", 3))
+            image = m.render()
+    # Every tile was fetched (twice, due to the injected failure) during the first render only
+    assert len(requested) == 2 * len(set(requested))
+    assert image.getpixel((0, 0)) == (0, 0, 255)
+
+
+def test_tile_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr("staticmap_mcp.server._TILE_CACHE_MAX_BYTES", 10)
+    _write_cached_tile("osm/1/0/0.png", b"12345")
+    _write_cached_tile("osm/1/0/1.png", b"12345")
+    os.utime(tmp_path / "cache" / "tiles" / "osm/1/0/0.png", (0, 0))
+    _write_cached_tile("osm/1/1/0.png", b"12345")
+    _trim_tile_cache()
+    assert _read_cached_tile("osm/1/0/0.png") is None
+    assert _read_cached_tile("osm/1/0/1.png") == b"12345"
+    assert _read_cached_tile("osm/1/1/0.png") == b"12345"
+
+
+def test_tile_cache_rescans_only_when_over_cap(monkeypatch):
+    scans = []
+    scan = server._scan_tile_cache
+    monkeypatch.setattr("staticmap_mcp.server._scan_tile_cache", lambda: scans.append(1) or scan())
+    monkeypatch.setattr("staticmap_mcp.server._TILE_CACHE_MAX_BYTES", 12)
+    for y in range(2):
+        _write_cached_tile(f"osm/1/0/{y}.png", b"12345")
+        _trim_tile_cache()
+    assert len(scans) == 1
+    _write_cached_tile("osm/1/1/0.png", b"12345")
+    _trim_tile_cache()
+    assert len(scans) == 2
+    assert server._tile_cache_bytes == 10
+
+
+def test_tile_cache_removes_stale_temp_files(tmp_path, monkeypatch):
+    monkeypatch.setattr("staticmap_mcp.server._TILE_CACHE_MAX_BYTES", 10)
+    tile_dir = tmp_path / "cache" / "tiles" / "osm" / "1" / "0"
+    tile_dir.mkdir(parents=True)
+    (tile_dir / "stale.tmp").write_bytes(b"12345")
+    os.utime(tile_dir / "stale.tmp", (0, 0))
+    (tile_dir / "fresh.tmp").write_bytes(b"12345")
+    _write_cached_tile("osm/1/0/0.png", b"12345")
+    _trim_tile_cache()
+    assert not (tile_dir / "stale.tmp").exists()
+    assert (tile_dir / "fresh.tmp").exists()
+    assert _read_cached_tile("osm/1/0/0.png") == b"12345"
+    assert server._tile_cache_bytes == 10
+
+
+@pytest.mark.skipif(server.numba is None, reason="numba not installed")
+def test_numba_projection_matches_numpy(monkeypatch):
+    m = StaticMap(800, 600)
+    m.zoom = 12
+    m.x_center = _lon_to_x(-17.2, m.zoom)
+    m.y_center = _lat_to_y(28.15, m.zoom)
+    lons = np.linspace(-17.5, -16.9, server._NUMBA_MIN_POINTS)
+    lats = np.linspace(27.9, 28.4, server._NUMBA_MIN_POINTS)
+    compiled = _make_projector(m)(lons, lats)
+    monkeypatch.setattr(server, "numba", None)
+    reference = _make_projector(m)(lons, lats)
+    assert np.abs(compiled[0] - reference[0]).max() <= 1
+    assert np.abs(compiled[1] - reference[1]).max() <= 1
+
+
+def _render_sample_tiles(client):
+    m = _TileMap(300, 200, url_template="https://tiles.test/{z}/{x}/{y}.png")
+    m.add_line(Line([(c[0], c[1]) for c in SAMPLE_COORDS], "black", 3))
+    with patch("staticmap_mcp.server._get_http_client", lambda: client):
+        return m.render()
+
+
+def test_tile_map_does_not_cache_non_image_responses():
+    requested = []
+    rate_limited = httpx.Response(200, content=b"<html>Too many requests</html>")
+    image = _render_sample_tiles(_tile_client(requested, rate_limited))
+    assert image.getpixel((0, 0)) == (0, 0, 255)
+    fetched = len(requested)
+
+    # Only the real tiles were cached, so a second render needs no network
+    image = _render_sample_tiles(_tile_client(requested))
+    assert len(requested) == fetched
+    assert image.getpixel((0, 0)) == (0, 0, 255)
+
+
+def test_tile_map_replaces_corrupt_cache_entries(tmp_path):
+    requested = []
+    _render_sample_tiles(_tile_client(requested))
+    corrupt = next((tmp_path / "cache" / "tiles").rglob("*.png"))
+    corrupt.write_bytes(b"not a png")
+
+    requested.clear()
+    image = _render_sample_tiles(_tile_client(requested, httpx.Response(200, content=b"")))
+    # Only the corrupt tile is fetched again (once rejected, once successfully)
+    assert len(requested) == 2 and len(set(requested)) == 1
+    assert image.getpixel((0, 0)) == (0, 0, 255)
+    assert Image.open(corrupt).size == (256, 256)
+
+
+def test_read_cached_tile_survives_failed_touch(monkeypatch):
+    _write_cached_tile("osm/1/0/0.png", b"12345")
+
+    def read_only(*args, **kwargs):
+        raise PermissionError
+
+    monkeypatch.setattr("staticmap_mcp.server.os.utime", read_only)
+    assert _read_cached_tile("osm/1/0/0.png") == b"12345"